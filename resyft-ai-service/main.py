@@ -1,24 +1,138 @@
 import os
+import ast
+import orjson
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import random
+import re
+import time
+import uuid
 import httpx
+from array import array
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+from urllib.parse import quote
 from fastapi import FastAPI, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, AsyncIterator, Callable, Coroutine, List, Optional, Union
 from supabase import create_client, Client
 
-app = FastAPI()
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# httpx logs every request at INFO; that's one line per OpenRouter call
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+try:
+    import tiktoken
+    tokenizer = tiktoken.get_encoding("cl100k_base")
+except Exception as e:
+    logger.warning("Could not load tiktoken, falling back to character estimates: %s", e)
+    tokenizer = None
+
+# One pooled OpenRouter client for every call: keep-alive connections and
+# HTTP/2 multiplexing avoid a TCP + TLS handshake per request. Pool sizes are
+# configurable for deployments running many workers against one egress.
+HTTP_MAX_CONNECTIONS = int(os.getenv("RESYFT_HTTP_MAX_CONNECTIONS", "256"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("RESYFT_HTTP_MAX_KEEPALIVE", "64"))
+http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            base_url="https://openrouter.ai/api/v1",
+            headers={
+                "Content-Type": "application/json",
+                "HTTP-Referer": os.getenv("YOUR_SITE_URL", "http://localhost:3000"),
+            },
+            http2=True,
+            limits=httpx.Limits(
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                max_connections=HTTP_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+    return http_client
+
+async def warm_http_client():
+    """Open the OpenRouter connection (DNS, TCP, TLS) before the first request"""
+    try:
+        # Any reply will do; HEAD skips downloading the model list
+        await get_http_client().head("/models", timeout=10.0)
+    except httpx.HTTPError as e:
+        logger.warning("Could not pre-connect to OpenRouter: %s", e)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, pdf_pool
+    # Build the Supabase client before serving, so the first embeddings
+    # request doesn't pay for it. A bad configuration mustn't stop the rest
+    # of the service; get_supabase() retries lazily and the embeddings
+    # endpoints report the error themselves.
+    try:
+        await asyncio.to_thread(get_supabase)
+    except Exception:
+        logger.exception("Could not create the Supabase client at startup")
+    # Connecting to OpenRouter doesn't hold up startup
+    warmup = asyncio.create_task(warm_http_client())
+    yield
+    warmup.cancel()
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+    if pdf_pool is not None:
+        pdf_pool.shutdown(cancel_futures=True)
+        pdf_pool = None
+
+app = FastAPI(lifespan=lifespan)
+
+# Bound the number of in-flight OpenRouter calls. Many small requests at high
+# concurrency give the best aggregate throughput; an unbounded gather over a
+# large form would instead trip provider rate limits (429s).
+LLM_MAX_CONCURRENCY = int(os.getenv("RESYFT_MAX_CONCURRENCY", "32"))
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
+# Optional cap on OpenRouter requests per minute (0 = none). Requests are
+# spaced evenly under the cap, so a large form is paced to the account's
+# rate limit instead of bursting into 429s and backing off.
+OPENROUTER_RPM = int(os.getenv("RESYFT_OPENROUTER_RPM", "0"))
+_next_request_at = 0.0
+
+async def wait_for_request_slot():
+    """Sleep until the next OpenRouter request fits under OPENROUTER_RPM"""
+    global _next_request_at
+    if OPENROUTER_RPM <= 0:
+        return
+    now = time.monotonic()
+    slot = max(now, _next_request_at)
+    _next_request_at = slot + 60.0 / OPENROUTER_RPM
+    if slot > now:
+        await asyncio.sleep(slot - now)
+
+# Supabase client, created on first use and shared like http_client so its
+# HTTP connections are reused across requests
+supabase_client: Optional[Client] = None
 
-# Initialize Supabase client
 def get_supabase() -> Optional[Client]:
+    global supabase_client
+    if supabase_client is not None:
+        return supabase_client
+
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_SERVICE_KEY")  # Use service key for backend operations
     if url and key:
-        print(f"Creating Supabase client with URL: {url}")
-        print(f"Service key present: {len(key)} characters")
-        return create_client(url, key)
+        logger.info("Creating Supabase client with URL: %s", url)
+        supabase_client = create_client(url, key)
+        return supabase_client
     else:
-        print(f"Supabase not configured - URL: {bool(url)}, Key: {bool(key)}")
+        logger.warning("Supabase not configured - URL: %s, Key: %s", bool(url), bool(key))
     return None
 
 # CORS - allow all origins
@@ -31,6 +145,13 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# Explicit preflight replies for the POST endpoints below
+PREFLIGHT_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "POST, OPTIONS",
+    "Access-Control-Allow-Headers": "*",
+}
+
 class FormSegment(BaseModel):
     text: str
     type: str
@@ -62,8 +183,104 @@ PII_KEYWORDS = ['social security', 'ssn', 'date of birth', 'dob', 'driver licens
     'passport', 'bank account', 'credit card', 'tax id', 'phone', 'email',
     'address', 'salary', 'income', 'signature']
 
+# One scan of the text instead of lowercasing and searching it per keyword
+_PII_RE = re.compile("|".join(map(re.escape, PII_KEYWORDS)), re.IGNORECASE)
+
 def check_pii(text: str) -> bool:
-    return any(kw in text.lower() for kw in PII_KEYWORDS)
+    return _PII_RE.search(text) is not None
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def segment_prompt_line(seg: FormSegment) -> str:
+    """Render a segment for a prompt with PDF spacing artifacts collapsed"""
+    return f"[{seg.type}] {_WHITESPACE_RE.sub(' ', seg.text).strip()}"
+
+# Scanned or image-only PDFs come through with no text; there is nothing for
+# the model to summarize, so don't pay for a call that can only guess
+NO_TEXT_ERROR = "No text content found in form"
+
+def has_summarizable_text(segments: List[FormSegment]) -> bool:
+    return any(seg.text.strip() for seg in segments)
+
+FIELD_SEGMENT_TYPES = ("Form Field", "Checkbox", "Dropdown")
+
+# Running headers and footers sit within this fraction of the page height
+# from the top or bottom edge
+RUNNING_TEXT_MARGIN = 0.1
+
+def in_page_margin(seg: FormSegment) -> bool:
+    margin = seg.page_height * RUNNING_TEXT_MARGIN
+    return seg.top <= margin or seg.top >= seg.page_height - margin
+
+def find_running_segments(segments: List[FormSegment]) -> set[int]:
+    """
+    Indices of running headers and footers (titles, form numbers, page
+    furniture): text in the page margins that repeats on most pages of a
+    multi-page form. It costs prompt tokens on every page without adding
+    anything. Fields and repeated labels in the page body are kept.
+    """
+    num_pages = len({seg.page_number for seg in segments})
+    if num_pages < 3:
+        return set()
+
+    candidates = [
+        (idx, seg) for idx, seg in enumerate(segments)
+        if seg.type not in FIELD_SEGMENT_TYPES and in_page_margin(seg)
+    ]
+    pages_by_text = defaultdict(set)
+    for _, seg in candidates:
+        pages_by_text[seg.text].add(seg.page_number)
+    return {idx for idx, seg in candidates if len(pages_by_text[seg.text]) * 2 > num_pages}
+
+# Token budget for form content embedded in a summary prompt, leaving
+# headroom for the instructions and the model's reply
+MAX_SUMMARY_CONTENT_TOKENS = 6000
+
+# UTF-8 bytes per token, calibrated from the prompt_tokens OpenRouter reports
+# so estimates stay close for non-English forms. Starts at the usual ~4.
+_bytes_per_token = 4.0
+BYTES_PER_TOKEN_EMA = 0.95
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate from the calibrated bytes-per-token ratio"""
+    return int(len(text.encode("utf-8")) / _bytes_per_token)
+
+def record_prompt_usage(prompt: str, data: dict) -> None:
+    """Fold a completion's reported prompt size into the bytes-per-token ratio"""
+    global _bytes_per_token
+    prompt_tokens = (data.get("usage") or {}).get("prompt_tokens")
+    if not prompt_tokens:
+        return
+    observed = len(prompt.encode("utf-8")) / prompt_tokens
+    _bytes_per_token = BYTES_PER_TOKEN_EMA * _bytes_per_token + (1 - BYTES_PER_TOKEN_EMA) * observed
+
+def count_tokens(text: str) -> int:
+    """
+    Token count of text (~4 characters per token without tiktoken). Unlike
+    estimate_tokens this doesn't drift, so it's safe to derive cache keys from.
+    """
+    if tokenizer is None:
+        return len(text) // 4
+    return len(tokenizer.encode(text))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Truncate text to a token budget (~4 characters per token without tiktoken)"""
+    # A fixed ratio, not the calibrated one: the cut decides the prompt text,
+    # and so the summary cache key, which mustn't drift with usage
+    if tokenizer is None:
+        max_chars = max_tokens * 4
+        if len(text) <= max_chars:
+            return text
+        return text[:max_chars] + " ... [truncated]"
+
+    # A BPE token covers at least one byte, so this many bytes can't go over
+    if len(text.encode("utf-8")) <= max_tokens:
+        return text
+
+    tokens = tokenizer.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return tokenizer.decode(tokens[:max_tokens]) + " ... [truncated]"
 
 # Embedding models
 class EmbeddingSegment(BaseModel):
@@ -94,6 +311,7 @@ class RAGChatRequest(BaseModel):
     message: str
     history: List[ChatMessageBase] = []
     current_form_context: Optional[str] = None  # Current form segments for immediate context
+    stream: bool = False  # Stream the reply as plain text; sources go in the X-RAG-Sources header
 
 class RAGChatResponse(BaseModel):
     success: bool
@@ -107,26 +325,193 @@ async def generate_embeddings(texts: List[str]) -> List[List[float]]:
     if not api_key:
         raise Exception("OPENROUTER_API_KEY not configured")
 
-    async with httpx.AsyncClient() as client:
+    async with llm_semaphore:
+        client = get_http_client()
+        await wait_for_request_slot()
         response = await client.post(
-            "https://openrouter.ai/api/v1/embeddings",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-            json={
+            "/embeddings",
+            headers=openrouter_headers(api_key),
+            content=orjson.dumps({
                 "model": "openai/text-embedding-ada-002",
                 "input": texts
-            },
+            }),
             timeout=60.0
         )
 
         if response.status_code == 200:
-            data = response.json()
+            data = orjson.loads(response.content)
             return [item["embedding"] for item in data["data"]]
         else:
             raise Exception(f"Embedding API error: {response.status_code}")
 
+# Query embeddings by text. An embedding depends only on the text, so these
+# never go stale; repeated questions ("what is this form for?") and retries
+# skip the embeddings round-trip. Search results aren't cached since they
+# change whenever a project's forms do. Kept as float32 arrays (~6 KB each
+# rather than ~50 KB as a list of Python floats); pgvector stores float32
+# anyway, so the search sees the same vector.
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+_query_embedding_cache: "OrderedDict[str, array]" = OrderedDict()
+
+async def embed_query(text: str) -> List[float]:
+    key = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+    embedding = _query_embedding_cache.get(key)
+    if embedding is not None:
+        _query_embedding_cache.move_to_end(key)
+        return embedding.tolist()
+
+    embedding = (await generate_embeddings([text]))[0]
+    _query_embedding_cache[key] = array("f", embedding)
+    if len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+        _query_embedding_cache.popitem(last=False)
+    return embedding
+
+# Transient OpenRouter failures are retried with jittered exponential backoff
+# before falling back to a cheaper model; other errors are returned as-is
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+OPENROUTER_MAX_ATTEMPTS = 3
+OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet")
+OPENROUTER_FALLBACK_MODEL = os.getenv("OPENROUTER_FALLBACK_MODEL", "anthropic/claude-3-haiku")
+
+# Optional larger-context model for chat requests whose form context and
+# history would crowd the default model; unset keeps everything on it
+OPENROUTER_LONG_CONTEXT_MODEL = os.getenv("OPENROUTER_LONG_CONTEXT_MODEL")
+LONG_CONTEXT_THRESHOLD_TOKENS = int(os.getenv("RESYFT_LONG_CONTEXT_THRESHOLD", "6000"))
+
+def select_chat_model(messages: List[dict], max_tokens: int) -> str:
+    """Default model, or the long-context one when the estimated request is too big"""
+    model = OPENROUTER_MODEL
+    if not OPENROUTER_LONG_CONTEXT_MODEL:
+        return model
+    total = sum(estimate_tokens(message["content"]) for message in messages) + max_tokens
+    return OPENROUTER_LONG_CONTEXT_MODEL if total >= LONG_CONTEXT_THRESHOLD_TOKENS else model
+
+# Rate-limited retries wait as long as OpenRouter asks (within reason). Callers
+# that can live with a shorter reply may also ask for a smaller one, which
+# counts for less against token-based limits.
+MAX_RETRY_AFTER_SECONDS = 20.0
+MIN_RETRY_MAX_TOKENS = 64
+
+def retry_after_seconds(response: httpx.Response) -> float:
+    """Delay requested by a Retry-After header in seconds, or 0 if absent"""
+    try:
+        return min(MAX_RETRY_AFTER_SECONDS, max(0.0, float(response.headers.get("retry-after", 0))))
+    except ValueError:
+        # HTTP-date form; fall back to the usual backoff
+        return 0.0
+
+def openrouter_headers(api_key: str) -> dict:
+    # Static headers live on the shared client; only auth is per call
+    return {"Authorization": f"Bearer {api_key}"}
+
+async def post_chat_completion(
+    payload: dict,
+    api_key: str,
+    timeout: float,
+    stream: bool = False,
+    shrink_on_rate_limit: bool = False
+) -> httpx.Response:
+    """
+    POST a chat completion to OpenRouter with retries and model fallback.
+    With stream=True the returned response's body is left unread, and the
+    caller must close it. With shrink_on_rate_limit, each 429 halves
+    max_tokens for the retry.
+    """
+    client = get_http_client()
+    headers = openrouter_headers(api_key)
+
+    models = [payload["model"]]
+    if OPENROUTER_FALLBACK_MODEL and OPENROUTER_FALLBACK_MODEL != payload["model"]:
+        models.append(OPENROUTER_FALLBACK_MODEL)
+
+    response = None
+    last_error: Optional[Exception] = None
+    for model in models:
+        # Serialized once per model and reused until a retry changes it
+        request = {**payload, "model": model}
+        body = orjson.dumps(request)
+        delay = 0.0
+        for attempt in range(OPENROUTER_MAX_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(delay or random.uniform(0, min(8.0, 0.5 * 2 ** attempt)))
+            await wait_for_request_slot()
+            try:
+                response = await client.send(
+                    client.build_request(
+                        "POST",
+                        "/chat/completions",
+                        headers=headers,
+                        content=body,
+                        timeout=timeout
+                    ),
+                    stream=stream
+                )
+            except httpx.TransportError as e:
+                logger.warning("OpenRouter request failed (%s, attempt %d): %s", model, attempt + 1, e)
+                last_error = e
+                delay = 0.0
+                continue
+
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                return response
+            logger.warning("OpenRouter returned %d (%s, attempt %d)", response.status_code, model, attempt + 1)
+            if stream:
+                await response.aclose()
+
+            delay = retry_after_seconds(response)
+            if shrink_on_rate_limit and response.status_code == 429 and "max_tokens" in request:
+                request["max_tokens"] = max(MIN_RETRY_MAX_TOKENS, request["max_tokens"] // 2)
+                body = orjson.dumps(request)
+
+    if response is None:
+        raise last_error
+    return response
+
+def answered_by_fallback(response: httpx.Response, model: str) -> bool:
+    """Whether post_chat_completion had to fall back from model to get this response"""
+    # Read from what was sent: the model id in the reply can carry a suffix
+    return orjson.loads(response.request.content)["model"] != model
+
+async def open_chat_stream(payload: dict, api_key: str, timeout: float) -> httpx.Response:
+    """Start a streamed chat completion, retried like post_chat_completion"""
+    return await post_chat_completion({**payload, "stream": True}, api_key, timeout, stream=True)
+
+async def iter_chat_deltas(response: httpx.Response) -> AsyncIterator[str]:
+    """Yield content deltas from a streamed OpenRouter chat completion"""
+    async for line in response.aiter_lines():
+        # Skip SSE comments (keep-alives) and blank separators
+        if not line.startswith("data: "):
+            continue
+        data = line[len("data: "):]
+        if data == "[DONE]":
+            break
+        delta = orjson.loads(data)["choices"][0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+def streaming_reply(response: httpx.Response, headers: Optional[dict] = None) -> StreamingResponse:
+    """
+    Relay an opened, successful chat stream to the client as plain text.
+    Errors past this point can't change the status any more, so they're
+    logged and the reply ends early.
+    """
+    async def reply_stream():
+        try:
+            async for delta in iter_chat_deltas(response):
+                yield delta
+        except Exception:
+            logger.exception("Chat stream error")
+        finally:
+            await response.aclose()
+
+    return StreamingResponse(
+        reply_stream(),
+        media_type="text/plain; charset=utf-8",
+        headers=headers,
+        # Also closes the upstream stream if the client left before it started
+        background=BackgroundTask(response.aclose),
+    )
+
 @app.get("/")
 def root():
     return {"status": "ok", "service": "form-filler-ai"}
@@ -138,11 +523,12 @@ def health():
 # Handle OPTIONS preflight for analyze-form
 @app.options("/analyze-form")
 async def options_analyze_form():
-    return JSONResponse(content={}, headers={
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "*",
-    })
+    return JSONResponse(content={}, headers=PREFLIGHT_HEADERS)
+
+# Keyword checks for classify_text_type, compiled once instead of scanning
+# the line once per keyword
+_SECTION_HEADER_RE = re.compile(r"section|part|step|instructions|information", re.IGNORECASE)
+_SIGNATURE_RE = re.compile(r"signature|sign here|date:", re.IGNORECASE)
 
 def classify_text_type(text: str, bbox: tuple, page_width: float, page_height: float) -> str:
     """Classify text based on content and position"""
@@ -152,7 +538,7 @@ def classify_text_type(text: str, bbox: tuple, page_width: float, page_height: f
 
     # Check for section headers (large text near top or left, short text)
     if len(text) < 50 and (y0 < page_height * 0.15 or text.endswith(':')):
-        if any(kw in text_lower for kw in ['section', 'part', 'step', 'instructions', 'information']):
+        if _SECTION_HEADER_RE.search(text):
             return "Section Header"
 
     # Check for form labels (short text ending with colon or near form fields)
@@ -164,7 +550,7 @@ def classify_text_type(text: str, bbox: tuple, page_width: float, page_height: f
         return "Checkbox"
 
     # Check for signature lines
-    if 'signature' in text_lower or 'sign here' in text_lower or 'date:' in text_lower:
+    if _SIGNATURE_RE.search(text):
         return "Signature"
 
     # Check for instructions (longer text)
@@ -173,19 +559,65 @@ def classify_text_type(text: str, bbox: tuple, page_width: float, page_height: f
 
     return "Text"
 
-@app.post("/analyze-form")
-async def analyze_form(file: UploadFile = File(...)):
+# Uploads larger than this are rejected before they're read into memory
+MAX_UPLOAD_BYTES = int(os.getenv("RESYFT_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+async def read_upload(file: UploadFile, limit: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Read an upload in chunks, failing as soon as it passes the size limit"""
+    too_large = ValueError(f"File too large (limit {limit // (1024 * 1024)} MB)")
+    if file.size is not None and file.size > limit:
+        raise too_large
+
+    content = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+        content += chunk
+        if len(content) > limit:
+            raise too_large
+    return bytes(content)
+
+# PyMuPDF holds the GIL while parsing, so worker threads parse one PDF at a
+# time and slow the event loop meanwhile. With RESYFT_PDF_WORKERS set, PDFs
+# are parsed in that many worker processes instead. Workers are started by a
+# forkserver: by the time the pool exists this process has threads, and a
+# plain fork can leave a child deadlocked on a lock one of them held.
+PDF_PARSE_WORKERS = int(os.getenv("RESYFT_PDF_WORKERS", "0"))
+pdf_pool: Optional[ProcessPoolExecutor] = None
+
+def get_pdf_pool() -> ProcessPoolExecutor:
+    global pdf_pool
+    if pdf_pool is None:
+        pdf_pool = ProcessPoolExecutor(
+            max_workers=PDF_PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return pdf_pool
+
+async def run_parse_form_pdf(content: bytes) -> tuple[int, List[FormSegment]]:
+    global pdf_pool
+    if PDF_PARSE_WORKERS <= 0:
+        return await asyncio.to_thread(parse_form_pdf, content)
+    loop = asyncio.get_running_loop()
+    pool = get_pdf_pool()
+    try:
+        return await loop.run_in_executor(pool, parse_form_pdf, content)
+    except BrokenProcessPool:
+        # A worker died (e.g. PyMuPDF crashing on a malformed PDF), which
+        # breaks the whole pool; replace it, unless a concurrent parse
+        # already did, and retry once
+        logger.warning("PDF worker pool broke; restarting it")
+        if pdf_pool is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            pdf_pool = None
+        return await loop.run_in_executor(get_pdf_pool(), parse_form_pdf, content)
+
+def parse_form_pdf(content: bytes) -> tuple[int, List[FormSegment]]:
+    """Page count and segments (text lines and form widgets) of a PDF"""
+    import fitz
+
+    # Opened straight from memory; no temporary file round-trip
+    doc = fitz.open(stream=content, filetype="pdf")
     try:
-        import fitz
-        import tempfile
-
-        content = await file.read()
-
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
-
-        doc = fitz.open(tmp_path)
         segments = []
 
         for page_num in range(len(doc)):
@@ -203,7 +635,8 @@ async def analyze_form(file: UploadFile = File(...)):
 
                         if line_text.strip():
                             text_type = classify_text_type(line_text, line_bbox, page_width, page_height)
-                            segments.append(FormSegment(
+                            # PyMuPDF already gives us the right types; skip per-field validation
+                            segments.append(FormSegment.model_construct(
                                 text=line_text.strip(),
                                 type=text_type,
                                 page_number=page_num+1,
@@ -237,7 +670,7 @@ async def analyze_form(file: UploadFile = File(...)):
 
                     display_text = f"{field_name}: {field_value}" if field_value else field_name
 
-                    segments.append(FormSegment(
+                    segments.append(FormSegment.model_construct(
                         text=display_text,
                         type=seg_type,
                         page_number=page_num+1,
@@ -250,9 +683,64 @@ async def analyze_form(file: UploadFile = File(...)):
                         is_pii=check_pii(display_text)
                     ))
 
-        num_pages = len(doc)
+        return len(doc), segments
+    finally:
         doc.close()
-        os.unlink(tmp_path)
+
+# Parsed forms by a hash of the PDF bytes: the same file is often uploaded
+# again (re-opened, shared within a project) and parses identically
+FORM_CACHE_SIZE = int(os.getenv("RESYFT_FORM_CACHE_SIZE", "64"))
+_form_cache: "OrderedDict[str, tuple[int, List[FormSegment]]]" = OrderedDict()
+
+def form_cache_key(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+async def coalesce(inflight: "dict[str, asyncio.Task]", key: str, make_coro: Callable[[], Coroutine]):
+    """
+    Await the task running for key in inflight, starting it from make_coro()
+    if there is none, so concurrent duplicate requests share one result
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(make_coro())
+        inflight[key] = task
+        task.add_done_callback(lambda _: inflight.pop(key, None))
+    # Shielded so one caller disconnecting doesn't cancel it for the others
+    return await asyncio.shield(task)
+
+# Parses in progress by cache key. A re-fired upload of the same PDF (the
+# frontend re-requests on re-render) waits for the running parse instead of
+# starting its own.
+_inflight_forms: "dict[str, asyncio.Task]" = {}
+
+async def parse_and_cache_form(cache_key: str, content: bytes) -> tuple[int, List[FormSegment]]:
+    """Parse a PDF and cache its page count and segments"""
+    parsed = await run_parse_form_pdf(content)
+    _form_cache[cache_key] = parsed
+    if len(_form_cache) > FORM_CACHE_SIZE:
+        _form_cache.popitem(last=False)
+    return parsed
+
+@app.post("/analyze-form", response_model=FormAnalysisResponse)
+async def analyze_form(file: UploadFile = File(...)):
+    try:
+        content = await read_upload(file)
+        # Sniff the header rather than trusting the filename or content type;
+        # readers accept it anywhere in the first 1 KB
+        if b"%PDF-" not in content[:1024]:
+            raise ValueError("Uploaded file is not a PDF")
+
+        # Hashing and PyMuPDF are CPU-bound; keep them off the event loop so
+        # concurrent LLM calls aren't stalled behind a large PDF
+        cache_key = await asyncio.to_thread(form_cache_key, content)
+        cached = _form_cache.get(cache_key)
+        if cached is not None:
+            _form_cache.move_to_end(cache_key)
+            num_pages, segments = cached
+        else:
+            num_pages, segments = await coalesce(
+                _inflight_forms, cache_key, lambda: parse_and_cache_form(cache_key, content)
+            )
 
         return FormAnalysisResponse(
             success=True,
@@ -271,6 +759,22 @@ async def analyze_form(file: UploadFile = File(...)):
             error=str(e)
         )
 
+FORM_SUMMARY_PROMPT = """Analyze this form and provide a brief, helpful summary in 2-3 sentences.
+
+Form: {filename}
+Content preview:
+{content_preview}
+
+PII fields detected: {pii_count}
+Form fields detected: {field_count}
+
+Provide:
+1. What type of form this appears to be
+2. Its main purpose
+3. Any important notes about filling it out
+
+Keep response under 100 words."""
+
 class SummaryRequest(BaseModel):
     segments: List[FormSegment]
     filename: str
@@ -299,17 +803,119 @@ class DetailedSummaryResponse(BaseModel):
     granularity: str = "page"  # "page" or "section"
     error: Optional[str] = None
 
+# Summaries are deterministic enough to reuse: forms are re-opened and
+# re-uploaded verbatim, so identical prompts skip the OpenRouter round-trip.
+# Entries expire so a model or prompt behaviour change eventually shows up.
+SUMMARY_CACHE_SIZE = int(os.getenv("RESYFT_SUMMARY_CACHE_SIZE", "1024"))
+SUMMARY_CACHE_TTL = float(os.getenv("RESYFT_SUMMARY_CACHE_TTL", "3600"))
+_summary_cache: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+
+def summary_cache_key(model: str, max_tokens: int, prompt: str) -> str:
+    """Content-addressed key for a summary prompt"""
+    return hashlib.blake2b(f"{model}|{max_tokens}|{prompt}".encode(), digest_size=16).hexdigest()
+
+# Optional on-disk layer under the in-memory LRU, so summaries survive
+# restarts and are shared by workers on the same host. Off unless
+# RESYFT_LLM_CACHE_DIR is set; entries expire on the same TTL via mtime, and
+# the directory is pruned to RESYFT_LLM_CACHE_MAX_FILES every so many writes.
+# File access runs in worker threads, off the event loop.
+SUMMARY_CACHE_DIR = os.getenv("RESYFT_LLM_CACHE_DIR")
+SUMMARY_CACHE_MAX_FILES = int(os.getenv("RESYFT_LLM_CACHE_MAX_FILES", "10000"))
+SUMMARY_CACHE_PRUNE_EVERY = 100
+_disk_summary_writes = 0
+if SUMMARY_CACHE_DIR:
+    os.makedirs(SUMMARY_CACHE_DIR, exist_ok=True)
+
+def summary_cache_path(key: str) -> str:
+    return os.path.join(SUMMARY_CACHE_DIR, f"{key}.txt")
+
+def read_disk_summary(key: str) -> Optional[str]:
+    path = summary_cache_path(key)
+    try:
+        if os.path.getmtime(path) + SUMMARY_CACHE_TTL < time.time():
+            os.unlink(path)
+            return None
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def prune_disk_summaries() -> None:
+    """Remove expired entries, then the oldest ones past SUMMARY_CACHE_MAX_FILES"""
+    expired_before = time.time() - SUMMARY_CACHE_TTL
+    entries = []
+    with os.scandir(SUMMARY_CACHE_DIR) as it:
+        for entry in it:
+            if not entry.name.endswith(".txt"):
+                continue
+            try:
+                mtime = entry.stat().st_mtime
+                if mtime < expired_before:
+                    os.unlink(entry.path)
+                else:
+                    entries.append((mtime, entry.path))
+            except OSError:
+                # Removed by another worker meanwhile
+                pass
+
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - SUMMARY_CACHE_MAX_FILES)]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def write_disk_summary(key: str, summary: str) -> None:
+    global _disk_summary_writes
+    path = summary_cache_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(summary)
+        os.replace(tmp_path, path)
+        _disk_summary_writes += 1
+        if _disk_summary_writes % SUMMARY_CACHE_PRUNE_EVERY == 0:
+            prune_disk_summaries()
+    except OSError as e:
+        logger.warning("Could not write summary cache entry %s: %s", key, e)
+
+def remember_summary(key: str, summary: str) -> None:
+    _summary_cache[key] = (time.monotonic() + SUMMARY_CACHE_TTL, summary)
+    _summary_cache.move_to_end(key)
+    if len(_summary_cache) > SUMMARY_CACHE_SIZE:
+        _summary_cache.popitem(last=False)
+
+async def get_cached_summary(key: str) -> Optional[str]:
+    entry = _summary_cache.get(key)
+    if entry is not None:
+        expires_at, summary = entry
+        if expires_at >= time.monotonic():
+            _summary_cache.move_to_end(key)
+            return summary
+        del _summary_cache[key]
+
+    if SUMMARY_CACHE_DIR:
+        summary = await asyncio.to_thread(read_disk_summary, key)
+        if summary is not None:
+            remember_summary(key, summary)
+            return summary
+    return None
+
+async def cache_summary(key: str, summary: str) -> None:
+    remember_summary(key, summary)
+    if SUMMARY_CACHE_DIR:
+        await asyncio.to_thread(write_disk_summary, key, summary)
+
 @app.options("/summarize-form")
 async def options_summarize_form():
-    return JSONResponse(content={}, headers={
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "*",
-    })
+    return JSONResponse(content={}, headers=PREFLIGHT_HEADERS)
 
-@app.post("/summarize-form")
+@app.post("/summarize-form", response_model=SummaryResponse)
 async def summarize_form(request: SummaryRequest):
     try:
+        if not has_summarizable_text(request.segments):
+            return SummaryResponse(success=False, error=NO_TEXT_ERROR)
+
         api_key = os.getenv("OPENROUTER_API_KEY")
         if not api_key:
             return SummaryResponse(
@@ -322,60 +928,57 @@ async def summarize_form(request: SummaryRequest):
         pii_fields = []
         form_fields = []
 
-        for seg in request.segments:
+        running_segments = find_running_segments(request.segments)
+        for idx, seg in enumerate(request.segments):
             if seg.is_pii:
                 pii_fields.append(seg.text)
-            if seg.type in ["Form Field", "Checkbox", "Dropdown"]:
+            if seg.type in FIELD_SEGMENT_TYPES:
                 form_fields.append(seg.text)
-            text_content.append(f"[{seg.type}] {seg.text}")
+            if idx not in running_segments:
+                text_content.append(segment_prompt_line(seg))
 
         # Limit content to avoid token limits
-        content_preview = "\n".join(text_content[:100])
-
-        prompt = f"""Analyze this form and provide a brief, helpful summary in 2-3 sentences.
+        content_preview = truncate_to_tokens("\n".join(text_content[:100]), MAX_SUMMARY_CONTENT_TOKENS)
 
-Form: {request.filename}
-Content preview:
-{content_preview}
+        prompt = FORM_SUMMARY_PROMPT.format(
+            filename=request.filename,
+            content_preview=content_preview,
+            pii_count=len(pii_fields),
+            field_count=len(form_fields)
+        )
 
-PII fields detected: {len(pii_fields)}
-Form fields detected: {len(form_fields)}
+        model = OPENROUTER_MODEL
+        cache_key = summary_cache_key(model, 200, prompt)
+        cached = await get_cached_summary(cache_key)
+        if cached is not None:
+            return SummaryResponse(success=True, summary=cached)
 
-Provide:
-1. What type of form this appears to be
-2. Its main purpose
-3. Any important notes about filling it out
-
-Keep response under 100 words."""
+        response = await post_chat_completion(
+            {
+                "model": model,
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ],
+                "max_tokens": 200,
+            },
+            api_key,
+            timeout=30.0
+        )
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": os.getenv("YOUR_SITE_URL", "http://localhost:3000"),
-                },
-                json={
-                    "model": os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet"),
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ],
-                    "max_tokens": 200,
-                },
-                timeout=30.0
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            record_prompt_usage(prompt, data)
+            summary = data["choices"][0]["message"]["content"]
+            # The key names the primary model; a fallback answer is only for now
+            if not answered_by_fallback(response, model):
+                await cache_summary(cache_key, summary)
+            return SummaryResponse(success=True, summary=summary)
+        else:
+            return SummaryResponse(
+                success=False,
+                error=f"API error: {response.status_code}"
             )
 
-            if response.status_code == 200:
-                data = response.json()
-                summary = data["choices"][0]["message"]["content"]
-                return SummaryResponse(success=True, summary=summary)
-            else:
-                return SummaryResponse(
-                    success=False,
-                    error=f"API error: {response.status_code}"
-                )
-
     except Exception as e:
         return SummaryResponse(
             success=False,
@@ -383,6 +986,10 @@ Keep response under 100 words."""
         )
 
 
+# Forms with more segments than this are summarized map-reduce style
+OVERVIEW_SEGMENT_LIMIT = 100
+
+
 def group_segments_by_page(segments: List[FormSegment]) -> dict[int, List[tuple[int, FormSegment]]]:
     """Group segments by page number with their original indices"""
     pages = {}
@@ -459,9 +1066,11 @@ def _generate_section_title(segments: List[FormSegment], section_num: int) -> st
     return f"Section {section_num}"
 
 
-async def generate_summary_for_content(content: str, context: str, api_key: str) -> str:
-    """Generate a concise summary for given content"""
-    prompt = f"""Summarize the following {context} in 1-2 clear, concise sentences.
+# Output budget for page/section summaries, scaled down for short content
+SUMMARY_MAX_TOKENS = 150
+SUMMARY_MIN_TOKENS = 60
+
+CONTENT_SUMMARY_PROMPT = """Summarize the following {context} in 1-2 clear, concise sentences.
 Focus on what information is required and what the purpose is.
 
 Content:
@@ -469,39 +1078,287 @@ Content:
 
 Provide only the summary, no preamble."""
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-                "HTTP-Referer": os.getenv("YOUR_SITE_URL", "http://localhost:3000"),
+# Page/section summaries are packed this many to a request, so the shared
+# instructions are sent once per batch and fewer requests count against the
+# provider's rate limit. Small batches keep per-item quality intact, and a
+# batch's items together stay within SUMMARY_BATCH_CONTENT_TOKENS so each gets
+# the same content it would get summarized alone.
+SUMMARY_BATCH_SIZE = 8
+SUMMARY_BATCH_CONTENT_TOKENS = 2 * MAX_SUMMARY_CONTENT_TOKENS
+
+BATCH_SUMMARY_PROMPT = """Summarize each of the following form parts in 1-2 clear, concise sentences.
+Focus on what information is required and what the purpose is.
+
+{items}
+
+Return only JSON of the form {{"summaries": [...]}} with {count} strings: one summary per ITEM, in order, no preamble."""
+
+# Structured output for batch replies, so providers that support it return
+# valid JSON rather than relying on the prompt alone
+SUMMARY_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "summary_batch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "summaries": {"type": "array", "items": {"type": "string"}},
             },
-            json={
-                "model": os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet"),
+            "required": ["summaries"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+# Models that rejected response_format; their later batches rely on the
+# prompt alone instead of paying for a failed request each time
+_models_without_response_format: set[str] = set()
+_RESPONSE_FORMAT_ERROR_RE = re.compile(r"response_format|json_schema|structured output", re.IGNORECASE)
+
+def rejected_response_format(response: httpx.Response) -> bool:
+    """Whether a reply is a 400 blaming response_format, not some other bad request"""
+    return response.status_code == 400 and bool(_RESPONSE_FORMAT_ERROR_RE.search(response.text))
+
+
+def content_summary_request(content: str, context: str) -> tuple[str, int]:
+    """Prompt and output token budget for summarizing a single page/section"""
+    content = truncate_to_tokens(content, MAX_SUMMARY_CONTENT_TOKENS)
+    prompt = CONTENT_SUMMARY_PROMPT.format(context=context, content=content)
+
+    # A 1-2 sentence summary of a few lines needs far less than the full
+    # budget; a tight cap stops the model padding out tiny sections
+    max_tokens = min(SUMMARY_MAX_TOKENS, SUMMARY_MIN_TOKENS + count_tokens(content))
+    return prompt, max_tokens
+
+
+# Identical summary prompts currently awaiting OpenRouter, keyed like the
+# cache, so concurrent duplicates share one completion instead of each
+# paying for their own
+_inflight_summaries: "dict[str, asyncio.Task]" = {}
+
+async def request_summary(prompt: str, max_tokens: int, model: str, cache_key: str, api_key: str) -> str:
+    """Run one summary completion and cache a successful result"""
+    async with llm_semaphore:
+        response = await post_chat_completion(
+            {
+                "model": model,
                 "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 150,
+                "max_tokens": max_tokens,
             },
-            timeout=30.0
+            api_key,
+            timeout=30.0,
+            # A somewhat shorter summary beats none during a rate-limit spell
+            shrink_on_rate_limit=True
         )
 
         if response.status_code == 200:
-            data = response.json()
-            return data["choices"][0]["message"]["content"].strip()
+            data = orjson.loads(response.content)
+            record_prompt_usage(prompt, data)
+            choice = data["choices"][0]
+            summary = choice["message"]["content"].strip()
+            # Neither a reply cut short by a shrunk retry nor one from the
+            # fallback model is what this key asked for
+            if choice.get("finish_reason") != "length" and not answered_by_fallback(response, model):
+                await cache_summary(cache_key, summary)
+            return summary
         else:
             return "Summary unavailable"
 
 
+async def generate_summary_for_content(content: str, context: str, api_key: str) -> str:
+    """Generate a concise summary for given content"""
+    prompt, max_tokens = content_summary_request(content, context)
+
+    model = OPENROUTER_MODEL
+    cache_key = summary_cache_key(model, max_tokens, prompt)
+    cached = await get_cached_summary(cache_key)
+    if cached is not None:
+        return cached
+
+    return await coalesce(
+        _inflight_summaries, cache_key, lambda: request_summary(prompt, max_tokens, model, cache_key, api_key)
+    )
+
+
+_JSON_START_RE = re.compile(r"[\[{]")
+
+def balanced_json_end(text: str, start: int) -> Optional[int]:
+    """End index of the bracketed value opening at text[start], skipping quoted strings"""
+    depth = 0
+    quote = None
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == quote:
+                quote = None
+        elif ch in "\"'":
+            quote = ch
+        elif ch in "[{":
+            depth += 1
+        elif ch in "]}":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    return None
+
+def parse_json_reply(text: str, accept: Callable[[Any], bool]):
+    """
+    First JSON value in a model reply that accept() approves. Models often
+    wrap it in code fences or prose, or emit Python-style quotes and trailing
+    commas, so after a strict parse each balanced bracketed span is tried in
+    turn; prose like "the [2] summaries" parses too, hence the shape check.
+    """
+    try:
+        value = orjson.loads(text)
+        if accept(value):
+            return value
+    except orjson.JSONDecodeError:
+        pass
+
+    for match in _JSON_START_RE.finditer(text):
+        end = balanced_json_end(text, match.start())
+        if end is None:
+            continue
+        candidate = text[match.start():end]
+        try:
+            value = orjson.loads(candidate)
+        except orjson.JSONDecodeError:
+            try:
+                value = ast.literal_eval(candidate)
+            except (ValueError, SyntaxError):
+                continue
+        if accept(value):
+            return value
+    return None
+
+def batch_summary_list(value: Any, count: int) -> Optional[List[str]]:
+    """The count summaries in a parsed batch reply ({"summaries": [...]} or a bare list), if it has them"""
+    if isinstance(value, dict):
+        value = value.get("summaries")
+    if not isinstance(value, list) or len(value) != count:
+        return None
+    if not all(isinstance(summary, str) and summary.strip() for summary in value):
+        return None
+    return value
+
+def parse_summary_batch(response: httpx.Response, prompt: str, count: int) -> Optional[List[str]]:
+    """Summaries from a batched completion, or None if the reply is unusable"""
+    if response.status_code != 200:
+        return None
+    try:
+        data = orjson.loads(response.content)
+        record_prompt_usage(prompt, data)
+        reply = data["choices"][0]["message"]["content"]
+    except (orjson.JSONDecodeError, KeyError, IndexError, TypeError):
+        return None
+    value = parse_json_reply(reply or "", lambda value: batch_summary_list(value, count) is not None)
+    if value is None:
+        return None
+    return [summary.strip() for summary in batch_summary_list(value, count)]
+
+
+async def generate_summary_batch(items: List[tuple[str, str]], api_key: str) -> List[str]:
+    """
+    Summarize several (content, context) pairs with one completion.
+    Items are cached individually; anything the batch reply doesn't cover
+    falls back to one call per item. Callers keep the batch within
+    SUMMARY_BATCH_CONTENT_TOKENS (see generate_summaries).
+    """
+    model = OPENROUTER_MODEL
+    requests = [content_summary_request(content, context) for content, context in items]
+    cache_keys = [summary_cache_key(model, max_tokens, prompt) for prompt, max_tokens in requests]
+    summaries = list(await asyncio.gather(*[get_cached_summary(key) for key in cache_keys]))
+
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    if len(missing) > 1:
+        # Truncated exactly as for a single summary, so a batched result
+        # matches what its cache key describes
+        prompt = BATCH_SUMMARY_PROMPT.format(
+            items="\n\n".join(
+                f"### ITEM {n}: {items[i][1]}\n{truncate_to_tokens(items[i][0], MAX_SUMMARY_CONTENT_TOKENS)}"
+                for n, i in enumerate(missing, 1)
+            ),
+            count=len(missing)
+        )
+
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": sum(requests[i][1] for i in missing),
+        }
+        structured = model not in _models_without_response_format
+        try:
+            async with llm_semaphore:
+                response = await post_chat_completion(
+                    {**payload, "response_format": SUMMARY_BATCH_RESPONSE_FORMAT} if structured else payload,
+                    api_key,
+                    timeout=60.0
+                )
+                if structured and rejected_response_format(response):
+                    # Model doesn't accept structured outputs; the prompt asks for the same shape
+                    logger.info("%s rejected response_format; batching without it", model)
+                    _models_without_response_format.add(model)
+                    response = await post_chat_completion(payload, api_key, timeout=60.0)
+            batch = parse_summary_batch(response, prompt, len(missing))
+            cacheable = not answered_by_fallback(response, model)
+        except Exception:
+            logger.exception("Batched summary error")
+            batch = None
+
+        if batch:
+            for i, summary in zip(missing, batch):
+                summaries[i] = summary
+                if cacheable:
+                    await cache_summary(cache_keys[i], summary)
+
+    # Single items and unusable batch replies are summarized one by one; a
+    # failed call only loses its own summary, not the whole response
+    remaining = [i for i, summary in enumerate(summaries) if summary is None]
+    fallback = await asyncio.gather(*[
+        generate_summary_for_content(items[i][0], items[i][1], api_key) for i in remaining
+    ], return_exceptions=True)
+    for i, summary in zip(remaining, fallback):
+        if isinstance(summary, Exception):
+            logger.error("Summary error", exc_info=summary)
+            summary = "Summary unavailable"
+        summaries[i] = summary
+    return summaries
+
+
+async def generate_summaries(items: List[tuple[str, str]], api_key: str) -> List[str]:
+    """Summarize (content, context) pairs in concurrent batches, bounded by llm_semaphore"""
+    # Pack items in order until a batch is full or its content would pass the
+    # token budget; an item that fills the budget alone is summarized alone
+    batches = []
+    current = []
+    current_tokens = 0
+    for content, context in items:
+        tokens = min(count_tokens(content), MAX_SUMMARY_CONTENT_TOKENS)
+        if current and (len(current) >= SUMMARY_BATCH_SIZE or current_tokens + tokens > SUMMARY_BATCH_CONTENT_TOKENS):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append((content, context))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+
+    results = await asyncio.gather(*[generate_summary_batch(batch, api_key) for batch in batches])
+    return [summary for batch in results for summary in batch]
+
+
 @app.options("/summarize-form-detailed")
 async def options_summarize_form_detailed():
-    return JSONResponse(content={}, headers={
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "*",
-    })
+    return JSONResponse(content={}, headers=PREFLIGHT_HEADERS)
 
 
-@app.post("/summarize-form-detailed")
+@app.post("/summarize-form-detailed", response_model=DetailedSummaryResponse)
 async def summarize_form_detailed(request: DetailedSummaryRequest):
     """
     Generate hierarchical summaries for a form:
@@ -510,6 +1367,9 @@ async def summarize_form_detailed(request: DetailedSummaryRequest):
     - Section-level summaries (if < 5 pages)
     """
     try:
+        if not has_summarizable_text(request.segments):
+            return DetailedSummaryResponse(success=False, error=NO_TEXT_ERROR)
+
         api_key = os.getenv("OPENROUTER_API_KEY")
         if not api_key:
             return DetailedSummaryResponse(
@@ -524,36 +1384,20 @@ async def summarize_form_detailed(request: DetailedSummaryRequest):
         use_page_level = num_pages >= 5
         granularity = "page" if use_page_level else "section"
 
-        # Generate overall summary (reuse existing logic)
-        text_content = [f"[{seg.type}] {seg.text}" for seg in segments[:100]]
-        pii_count = sum(1 for seg in segments if seg.is_pii)
-        field_count = sum(1 for seg in segments if seg.type in ["Form Field", "Checkbox", "Dropdown"])
-
-        overall_prompt = f"""Analyze this form and provide a brief, helpful summary in 2-3 sentences.
-
-Form: {request.filename}
-Pages: {num_pages}
-Content preview:
-{chr(10).join(text_content)}
-
-PII fields detected: {pii_count}
-Form fields detected: {field_count}
-
-Provide:
-1. What type of form this appears to be
-2. Its main purpose
-3. Any important notes about filling it out
+        # Render each segment once; the overview and the page/section prompts
+        # share these lines. Running headers/footers render as None.
+        running_segments = find_running_segments(segments)
+        prompt_lines = [
+            None if idx in running_segments else segment_prompt_line(seg)
+            for idx, seg in enumerate(segments)
+        ]
 
-Keep response under 100 words."""
+        # Content for the overall summary
+        text_content = [line for line in prompt_lines if line is not None][:OVERVIEW_SEGMENT_LIMIT]
 
-        overall_summary = await generate_summary_for_content(
-            chr(10).join(text_content),
-            "form overview",
-            api_key
-        )
-
-        # Generate detailed summaries
-        detailed_summaries = []
+        # Collect every summary we need, then run them concurrently
+        # (bounded by llm_semaphore) instead of one round-trip at a time
+        pending = []  # (id, title, segment_ids, content, context)
 
         if use_page_level:
             # Group by page
@@ -564,24 +1408,20 @@ Keep response under 100 words."""
                 page_segments = [seg for _, seg in indexed_segs]
                 segment_indices = [idx for idx, _ in indexed_segs]
 
-                # Build content for this page
-                page_content = "\n".join([f"[{seg.type}] {seg.text}" for seg in page_segments[:50]])
-
                 # Skip pages with very little content
                 if len(page_segments) < 3:
                     continue
 
-                summary = await generate_summary_for_content(
-                    page_content,
-                    f"page {page_num} of the form",
-                    api_key
-                )
+                # Build content for this page
+                page_lines = (prompt_lines[idx] for idx in segment_indices[:50])
+                page_content = "\n".join(line for line in page_lines if line is not None)
 
-                detailed_summaries.append(DetailedSummary(
-                    id=f"page-{page_num}",
-                    title=f"Page {page_num}",
-                    summary=summary,
-                    segment_ids=segment_indices
+                pending.append((
+                    f"page-{page_num}",
+                    f"Page {page_num}",
+                    segment_indices,
+                    page_content,
+                    f"page {page_num} of the form"
                 ))
 
         else:
@@ -592,26 +1432,47 @@ Keep response under 100 words."""
                 section_segments = [seg for _, seg in indexed_segs]
                 segment_indices = [idx for idx, _ in indexed_segs]
 
-                # Build content for this section
-                section_content = "\n".join([f"[{seg.type}] {seg.text}" for seg in section_segments])
-
                 # Skip very small sections
                 if len(section_segments) < 2:
                     continue
 
-                summary = await generate_summary_for_content(
-                    section_content,
-                    f"section: {section_title}",
-                    api_key
-                )
+                # Build content for this section
+                section_lines = (prompt_lines[idx] for idx in segment_indices)
+                section_content = "\n".join(line for line in section_lines if line is not None)
 
-                detailed_summaries.append(DetailedSummary(
-                    id=f"section-{section_idx}",
-                    title=section_title,
-                    summary=summary,
-                    segment_ids=segment_indices
+                pending.append((
+                    f"section-{section_idx}",
+                    section_title,
+                    segment_indices,
+                    section_content,
+                    f"section: {section_title}"
                 ))
 
+        if len(segments) <= OVERVIEW_SEGMENT_LIMIT or not pending:
+            # The whole form fits in one prompt: summarize everything in one pass
+            overall_summary, *summaries = await generate_summaries(
+                [(chr(10).join(text_content), "form overview")] +
+                [(content, context) for _, _, _, content, context in pending],
+                api_key
+            )
+        else:
+            # Map-reduce: the overview prompt would only see the first segments,
+            # so build it from the page/section summaries instead
+            summaries = await generate_summaries(
+                [(content, context) for _, _, _, content, context in pending],
+                api_key
+            )
+            overall_summary = await generate_summary_for_content(
+                "\n".join(f"{title}: {summary}" for (_, title, _, _, _), summary in zip(pending, summaries)),
+                "form overview, given as summaries of each of its parts",
+                api_key
+            )
+
+        detailed_summaries = [
+            DetailedSummary(id=item_id, title=title, summary=summary, segment_ids=segment_indices)
+            for (item_id, title, segment_indices, _, _), summary in zip(pending, summaries)
+        ]
+
         return DetailedSummaryResponse(
             success=True,
             overall_summary=overall_summary,
@@ -620,13 +1481,32 @@ Keep response under 100 words."""
         )
 
     except Exception as e:
-        print(f"Detailed summary error: {e}")
+        logger.exception("Detailed summary error")
         return DetailedSummaryResponse(
             success=False,
             error=str(e)
         )
 
 
+# The system prompts are static and the form content follows as its own
+# message, so providers with prefix caching can reuse the instructions across
+# every conversation and the form content across turns of one
+CHAT_SYSTEM_PROMPT = """You are a helpful AI assistant that helps users understand and fill out forms.
+You have access to the form content in the next message (may include multiple forms from a project).
+
+Help the user understand the forms, explain what information is needed for each field,
+and provide guidance on how to complete them correctly. Be concise and helpful.
+If the user asks about a specific form, focus on that form's content.
+If asked about something not in the provided forms, politely explain that you can only help with the available form content."""
+
+FORM_CONTEXT_MESSAGE = """Form content:
+
+{context}"""
+
+# Form content sent with a chat turn is capped: every token of it is paid for
+# again on each message of the conversation and delays the first reply token
+MAX_CHAT_CONTEXT_TOKENS = int(os.getenv("RESYFT_MAX_CHAT_CONTEXT_TOKENS", "24000"))
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -635,6 +1515,7 @@ class ChatRequest(BaseModel):
     message: str
     context: str
     history: List[ChatMessage] = []
+    stream: bool = False  # Stream the reply as plain text instead of a ChatResponse
 
 class ChatResponse(BaseModel):
     success: bool
@@ -643,13 +1524,9 @@ class ChatResponse(BaseModel):
 
 @app.options("/chat")
 async def options_chat():
-    return JSONResponse(content={}, headers={
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "*",
-    })
+    return JSONResponse(content={}, headers=PREFLIGHT_HEADERS)
 
-@app.post("/chat")
+@app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     try:
         api_key = os.getenv("OPENROUTER_API_KEY")
@@ -661,18 +1538,10 @@ async def chat(request: ChatRequest):
 
         # Build conversation messages
         messages = [
-            {
-                "role": "system",
-                "content": f"""You are a helpful AI assistant that helps users understand and fill out forms.
-You have access to the following form content (may include multiple forms from a project):
-
-{request.context}
-
-Help the user understand the forms, explain what information is needed for each field,
-and provide guidance on how to complete them correctly. Be concise and helpful.
-If the user asks about a specific form, focus on that form's content.
-If asked about something not in the provided forms, politely explain that you can only help with the available form content."""
-            }
+            {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+            {"role": "system", "content": FORM_CONTEXT_MESSAGE.format(
+                context=truncate_to_tokens(request.context, MAX_CHAT_CONTEXT_TOKENS)
+            )},
         ]
 
         # Add conversation history
@@ -688,31 +1557,39 @@ If asked about something not in the provided forms, politely explain that you ca
             "content": request.message
         })
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": os.getenv("YOUR_SITE_URL", "http://localhost:3000"),
-                },
-                json={
-                    "model": os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet"),
-                    "messages": messages,
-                    "max_tokens": 1000,
-                },
-                timeout=60.0  # Increased timeout for larger contexts
-            )
-
-            if response.status_code == 200:
-                data = response.json()
-                reply = data["choices"][0]["message"]["content"]
-                return ChatResponse(success=True, response=reply)
-            else:
+        payload = {
+            "model": select_chat_model(messages, 1000),
+            "messages": messages,
+            "max_tokens": 1000,
+        }
+
+        if request.stream:
+            # Opened before replying, so an upstream failure is still
+            # reported as a ChatResponse error rather than an empty 200
+            response = await open_chat_stream(payload, api_key, timeout=60.0)
+            if response.status_code != 200:
+                await response.aclose()
                 return ChatResponse(
                     success=False,
                     error=f"API error: {response.status_code}"
                 )
+            return streaming_reply(response)
+
+        response = await post_chat_completion(
+            payload,
+            api_key,
+            timeout=60.0  # Increased timeout for larger contexts
+        )
+
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            reply = data["choices"][0]["message"]["content"]
+            return ChatResponse(success=True, response=reply)
+        else:
+            return ChatResponse(
+                success=False,
+                error=f"API error: {response.status_code}"
+            )
 
     except Exception as e:
         return ChatResponse(
@@ -723,50 +1600,134 @@ If asked about something not in the provided forms, politely explain that you ca
 
 # ============== RAG Endpoints ==============
 
+RAG_CHAT_SYSTEM_PROMPT = """You are a helpful AI assistant that helps users understand and fill out forms.
+You have access to the form content in the next message.
+
+Help the user understand the forms, explain what information is needed for each field,
+and provide guidance on how to complete them correctly. Be concise and helpful.
+When answering questions, prioritize information from the current form being viewed.
+Cite which form the information comes from when relevant."""
+
+# Concurrent insert requests per /store-embeddings call
+SUPABASE_INSERT_CONCURRENCY = 4
+
+def segment_row_id(request: StoreEmbeddingsRequest, idx: int) -> str:
+    """
+    Row id of a form's idx-th segment. Derived from the form and the segment's
+    position, so storing the same form again overwrites its rows instead of
+    duplicating every segment in search results.
+    """
+    return str(uuid.uuid5(
+        uuid.NAMESPACE_URL,
+        f"{request.user_id}:{request.project_id}:{request.form_id}:{idx}"
+    ))
+
+async def delete_stale_segment_rows(supabase: Client, request: StoreEmbeddingsRequest, keep_ids: set[str]) -> int:
+    """
+    Delete the form's stored rows that the new upload won't overwrite: rows
+    past its new segment count, and rows stored with random ids before ids
+    were derived from the segment position
+    """
+    table = supabase.table("segment_embeddings")
+    page_size = 1000  # PostgREST's default row limit
+    stored_ids = []
+    while True:
+        result = await asyncio.to_thread(
+            table.select("id")
+            .eq("user_id", request.user_id)
+            .eq("project_id", request.project_id)
+            .eq("form_id", request.form_id)
+            .order("id")
+            .range(len(stored_ids), len(stored_ids) + page_size - 1)
+            .execute
+        )
+        stored_ids.extend(row["id"] for row in result.data)
+        if len(result.data) < page_size:
+            break
+
+    stale_ids = [row_id for row_id in stored_ids if row_id not in keep_ids]
+    # Chunked so the id list stays well within URL length limits
+    for i in range(0, len(stale_ids), 100):
+        await asyncio.to_thread(table.delete().in_("id", stale_ids[i:i + 100]).execute)
+    return len(stale_ids)
+
 @app.options("/store-embeddings")
 async def options_store_embeddings():
-    return JSONResponse(content={}, headers={
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "*",
-    })
+    return JSONResponse(content={}, headers=PREFLIGHT_HEADERS)
 
-@app.post("/store-embeddings")
+@app.post("/store-embeddings", response_model=StoreEmbeddingsResponse)
 async def store_embeddings(request: StoreEmbeddingsRequest):
     """Store segment embeddings in Supabase for RAG retrieval"""
     try:
-        print(f"Store embeddings called: user_id={request.user_id}, project_id={request.project_id}, form_name={request.form_name}, segments={len(request.segments)}")
+        logger.debug(
+            "Store embeddings called: user_id=%s, project_id=%s, form_name=%s, segments=%d",
+            request.user_id, request.project_id, request.form_name, len(request.segments)
+        )
         supabase = get_supabase()
         if not supabase:
-            print("ERROR: Supabase client not created")
+            logger.error("Supabase client not created")
             return StoreEmbeddingsResponse(
                 success=False,
                 error="Supabase not configured. Set SUPABASE_URL and SUPABASE_SERVICE_KEY."
             )
 
         # Filter out very short segments
-        valid_segments = [s for s in request.segments if len(s.text.strip()) > 10]
+        # Kept with their position in the form, which their row ids derive from
+        valid_segments = [(idx, s) for idx, s in enumerate(request.segments) if len(s.text.strip()) > 10]
+
+        # Drop the form's old rows first; the rest are overwritten below
+        stale = await delete_stale_segment_rows(
+            supabase, request, {segment_row_id(request, idx) for idx, _ in valid_segments}
+        )
+        if stale:
+            logger.debug("Deleted %d stale embeddings of form %s", stale, request.form_id)
         if not valid_segments:
             return StoreEmbeddingsResponse(success=True, stored_count=0)
 
-        # Generate embeddings in batches of 100
+        # Forms repeat a lot of text (running headers, option labels), so each
+        # distinct text is embedded once and its vector shared. Batches of 100
+        # are embedded concurrently (bounded by llm_semaphore) and each is
+        # stored as soon as its vectors arrive, so inserts overlap the
+        # remaining embedding calls. A batch whose embeddings fail is skipped
+        # without losing the others; failed inserts are reported along with
+        # how many rows were stored.
         batch_size = 100
-        total_stored = 0
-
-        for i in range(0, len(valid_segments), batch_size):
-            batch = valid_segments[i:i + batch_size]
-            texts = [s.text for s in batch]
-
+        unique_texts = list(dict.fromkeys(s.text for _, s in valid_segments))
+        text_batches = [unique_texts[i:i + batch_size] for i in range(0, len(unique_texts), batch_size)]
+        batch_of_text = {text: i // batch_size for i, text in enumerate(unique_texts)}
+        segments_by_batch = [[] for _ in text_batches]
+        for idx, seg in valid_segments:
+            segments_by_batch[batch_of_text[seg.text]].append((idx, seg))
+
+        # supabase-py is synchronous, so each insert runs in a worker thread,
+        # a few at a time, instead of blocking the loop
+        insert_slots = asyncio.Semaphore(SUPABASE_INSERT_CONCURRENCY)
+
+        async def insert_batch(batch: List[dict]) -> int:
+            async with insert_slots:
+                try:
+                    result = await asyncio.to_thread(
+                        supabase.table("segment_embeddings").upsert(batch).execute
+                    )
+                except Exception:
+                    logger.exception("Failed to insert batch of %d records", len(batch))
+                    raise
+            logger.debug("Stored %d embeddings", len(result.data or batch))
+            return len(batch)
+
+        async def embed_and_store(
+            texts: List[str], batch_segments: List[tuple[int, EmbeddingSegment]]
+        ) -> List[Union[int, BaseException]]:
             try:
                 embeddings = await generate_embeddings(texts)
             except Exception as e:
-                print(f"Embedding generation error: {e}")
-                continue
+                logger.exception("Embedding generation error")
+                return [e]
+            embedding_by_text = dict(zip(texts, embeddings))
 
-            # Prepare records for insertion
-            records = []
-            for seg, embedding in zip(batch, embeddings):
-                records.append({
+            records = [
+                {
+                    "id": segment_row_id(request, idx),
                     "user_id": request.user_id,
                     "project_id": request.project_id,
                     "form_id": request.form_id,
@@ -775,35 +1736,45 @@ async def store_embeddings(request: StoreEmbeddingsRequest):
                     "segment_type": seg.type,
                     "page_number": seg.page_number,
                     "is_pii": seg.is_pii,
-                    "embedding": embedding
-                })
-
-            # Insert into Supabase
-            try:
-                result = supabase.table("segment_embeddings").insert(records).execute()
-                print(f"Successfully stored {len(records)} embeddings. Result: {result}")
-                total_stored += len(records)
-            except Exception as insert_error:
-                print(f"Failed to insert batch: {insert_error}")
-                print(f"Records attempted: {len(records)}")
-                raise
-
+                    "embedding": embedding_by_text[seg.text]
+                }
+                for idx, seg in batch_segments
+            ]
+            # Repeated texts can give a batch more than batch_size segments
+            return await asyncio.gather(*[
+                insert_batch(records[i:i + batch_size]) for i in range(0, len(records), batch_size)
+            ], return_exceptions=True)
+
+        # Failures are collected rather than raised, so every batch has
+        # finished (or failed) by the time the response is sent
+        batch_results = await asyncio.gather(*[
+            embed_and_store(texts, batch_segments)
+            for texts, batch_segments in zip(text_batches, segments_by_batch)
+        ], return_exceptions=True)
+        results = []
+        for batch_result in batch_results:
+            results.extend([batch_result] if isinstance(batch_result, BaseException) else batch_result)
+        total_stored = sum(r for r in results if not isinstance(r, BaseException))
+        errors = [r for r in results if isinstance(r, BaseException)]
+
+        if errors:
+            return StoreEmbeddingsResponse(
+                success=False,
+                stored_count=total_stored,
+                error=f"Failed to store {len(errors)} batch(es): {errors[0]}"
+            )
         return StoreEmbeddingsResponse(success=True, stored_count=total_stored)
 
     except Exception as e:
-        print(f"Store embeddings error: {e}")
+        logger.exception("Store embeddings error")
         return StoreEmbeddingsResponse(success=False, error=str(e))
 
 
 @app.options("/rag-chat")
 async def options_rag_chat():
-    return JSONResponse(content={}, headers={
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "POST, OPTIONS",
-        "Access-Control-Allow-Headers": "*",
-    })
+    return JSONResponse(content={}, headers=PREFLIGHT_HEADERS)
 
-@app.post("/rag-chat")
+@app.post("/rag-chat", response_model=RAGChatResponse)
 async def rag_chat(request: RAGChatRequest):
     """Chat with RAG - retrieves relevant segments via semantic search"""
     try:
@@ -820,18 +1791,20 @@ async def rag_chat(request: RAGChatRequest):
         if supabase:
             try:
                 # Generate embedding for the query
-                query_embedding = (await generate_embeddings([request.message]))[0]
-
-                # Search for similar segments
-                result = supabase.rpc(
-                    "search_segments",
-                    {
-                        "query_embedding": query_embedding,
-                        "match_project_id": request.project_id,
-                        "match_user_id": request.user_id,
-                        "match_count": 30
-                    }
-                ).execute()
+                query_embedding = await embed_query(request.message)
+
+                # Search for similar segments (synchronous client, so off the loop)
+                result = await asyncio.to_thread(
+                    supabase.rpc(
+                        "search_segments",
+                        {
+                            "query_embedding": query_embedding,
+                            "match_project_id": request.project_id,
+                            "match_user_id": request.user_id,
+                            "match_count": 30
+                        }
+                    ).execute
+                )
 
                 if result.data:
                     for row in result.data:
@@ -842,8 +1815,8 @@ async def rag_chat(request: RAGChatRequest):
                         if row['form_name'] not in sources:
                             sources.append(row['form_name'])
 
-            except Exception as e:
-                print(f"RAG search error: {e}")
+            except Exception:
+                logger.exception("RAG search error")
                 # Fall back to no context if search fails
 
         # Build context from retrieved segments and current form
@@ -851,7 +1824,9 @@ async def rag_chat(request: RAGChatRequest):
 
         # Add current form context if provided (immediate context for the form being viewed)
         if request.current_form_context:
-            context_parts.append("Current form content:\n" + request.current_form_context)
+            context_parts.append(
+                "Current form content:\n" + truncate_to_tokens(request.current_form_context, MAX_CHAT_CONTEXT_TOKENS)
+            )
 
         # Add RAG-retrieved segments from other forms
         if context_segments:
@@ -864,18 +1839,8 @@ async def rag_chat(request: RAGChatRequest):
 
         # Build messages for LLM
         messages = [
-            {
-                "role": "system",
-                "content": f"""You are a helpful AI assistant that helps users understand and fill out forms.
-You have access to the following form content:
-
-{context}
-
-Help the user understand the forms, explain what information is needed for each field,
-and provide guidance on how to complete them correctly. Be concise and helpful.
-When answering questions, prioritize information from the current form being viewed.
-Cite which form the information comes from when relevant."""
-            }
+            {"role": "system", "content": RAG_CHAT_SYSTEM_PROMPT},
+            {"role": "system", "content": FORM_CONTEXT_MESSAGE.format(context=context)},
         ]
 
         # Add conversation history
@@ -884,32 +1849,32 @@ Cite which form the information comes from when relevant."""
 
         messages.append({"role": "user", "content": request.message})
 
-        # Call LLM
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                    "HTTP-Referer": os.getenv("YOUR_SITE_URL", "http://localhost:3000"),
-                },
-                json={
-                    "model": os.getenv("OPENROUTER_MODEL", "anthropic/claude-3.5-sonnet"),
-                    "messages": messages,
-                    "max_tokens": 1000,
-                },
-                timeout=60.0
-            )
+        payload = {
+            "model": select_chat_model(messages, 1000),
+            "messages": messages,
+            "max_tokens": 1000,
+        }
 
-            if response.status_code == 200:
-                data = response.json()
-                reply = data["choices"][0]["message"]["content"]
-                return RAGChatResponse(success=True, response=reply, sources=sources)
-            else:
+        if request.stream:
+            response = await open_chat_stream(payload, api_key, timeout=60.0)
+            if response.status_code != 200:
+                await response.aclose()
                 return RAGChatResponse(success=False, error=f"API error: {response.status_code}")
+            # Form names may be non-ASCII, so the JSON list is percent-encoded
+            return streaming_reply(response, headers={"X-RAG-Sources": quote(orjson.dumps(sources))})
+
+        # Call LLM
+        response = await post_chat_completion(payload, api_key, timeout=60.0)
+
+        if response.status_code == 200:
+            data = orjson.loads(response.content)
+            reply = data["choices"][0]["message"]["content"]
+            return RAGChatResponse(success=True, response=reply, sources=sources)
+        else:
+            return RAGChatResponse(success=False, error=f"API error: {response.status_code}")
 
     except Exception as e:
-        print(f"RAG chat error: {e}")
+        logger.exception("RAG chat error")
         return RAGChatResponse(success=False, error=str(e))
 
 
@@ -921,9 +1886,11 @@ async def clear_embeddings(project_id: str, user_id: str):
         if not supabase:
             return {"success": False, "error": "Supabase not configured"}
 
-        supabase.table("segment_embeddings").delete().eq(
-            "project_id", project_id
-        ).eq("user_id", user_id).execute()
+        await asyncio.to_thread(
+            supabase.table("segment_embeddings").delete().eq(
+                "project_id", project_id
+            ).eq("user_id", user_id).execute
+        )
 
         return {"success": True}
     except Exception as e:
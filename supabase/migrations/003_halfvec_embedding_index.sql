@@ -0,0 +1,62 @@
+-- Index embeddings as half-precision vectors
+-- A halfvec(1536) index is half the size of the vector(1536) one, so more of
+-- it stays in memory. The table keeps full-precision embeddings, which are
+-- used to rescore the candidates the index returns. Requires pgvector 0.7+.
+
+-- Replace the ivfflat index (built once with fixed lists, so recall drifts as
+-- rows are added) with an HNSW index over the halfvec cast
+drop index if exists segment_embeddings_embedding_idx;
+
+create index if not exists segment_embeddings_embedding_halfvec_idx
+  on segment_embeddings
+  using hnsw ((embedding::halfvec(1536)) halfvec_cosine_ops);
+
+-- Search the halfvec index for twice as many candidates as requested, then
+-- rank those by full-precision distance
+create or replace function search_segments(
+  query_embedding vector(1536),
+  match_project_id text,
+  match_user_id uuid,
+  match_count int default 30
+)
+returns table (
+  id uuid,
+  form_name text,
+  segment_text text,
+  segment_type text,
+  page_number int,
+  is_pii boolean,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  return query
+  with candidates as (
+    select
+      se.id,
+      se.form_name,
+      se.segment_text,
+      se.segment_type,
+      se.page_number,
+      se.is_pii,
+      se.embedding
+    from segment_embeddings se
+    where se.project_id = match_project_id
+      and se.user_id = match_user_id
+    order by se.embedding::halfvec(1536) <=> query_embedding::halfvec(1536)
+    limit match_count * 2
+  )
+  select
+    c.id,
+    c.form_name,
+    c.segment_text,
+    c.segment_type,
+    c.page_number,
+    c.is_pii,
+    1 - (c.embedding <=> query_embedding) as similarity
+  from candidates c
+  order by c.embedding <=> query_embedding
+  limit match_count;
+end;
+$$;
@@ -0,0 +1,15 @@
+-- Composite index for the project + user filter
+-- search_segments and the clear-embeddings delete both filter on project_id
+-- and user_id together. One composite index answers that directly instead
+-- of intersecting the two single-column ones. For a typical project (a few
+-- forms, a few thousand segments) the planner can also use it to fetch the
+-- project's rows and rank them exactly, rather than post-filtering an
+-- approximate HNSW scan over every user's embeddings.
+create index if not exists segment_embeddings_project_user_idx
+  on segment_embeddings(project_id, user_id);
+
+-- Covered by the composite index's leading column
+drop index if exists segment_embeddings_project_idx;
+
+-- segment_embeddings_user_idx stays: RLS policies and the auth.users
+-- cascade filter on user_id alone
@@ -0,0 +1,60 @@
+-- Rank segment embeddings by inner product
+-- text-embedding-ada-002 returns unit-length vectors, for which the inner
+-- product equals cosine similarity. Ordering by <#> (negative inner product)
+-- gives the same ranking and scores as <=> without computing two norms and
+-- a division per comparison in the HNSW scan and the rescore.
+drop index if exists segment_embeddings_embedding_halfvec_idx;
+
+create index if not exists segment_embeddings_embedding_halfvec_idx
+  on segment_embeddings
+  using hnsw ((embedding::halfvec(1536)) halfvec_ip_ops)
+  with (m = 16, ef_construction = 400);
+
+create or replace function search_segments(
+  query_embedding vector(1536),
+  match_project_id text,
+  match_user_id uuid,
+  match_count int default 30
+)
+returns table (
+  id uuid,
+  form_name text,
+  segment_text text,
+  segment_type text,
+  page_number int,
+  is_pii boolean,
+  similarity float
+)
+language plpgsql
+set hnsw.ef_search = 100
+as $$
+begin
+  return query
+  with candidates as (
+    select
+      se.id,
+      se.form_name,
+      se.segment_text,
+      se.segment_type,
+      se.page_number,
+      se.is_pii,
+      se.embedding
+    from segment_embeddings se
+    where se.project_id = match_project_id
+      and se.user_id = match_user_id
+    order by se.embedding::halfvec(1536) <#> query_embedding::halfvec(1536)
+    limit match_count * 2
+  )
+  select
+    c.id,
+    c.form_name,
+    c.segment_text,
+    c.segment_type,
+    c.page_number,
+    c.is_pii,
+    -(c.embedding <#> query_embedding) as similarity
+  from candidates c
+  order by c.embedding <#> query_embedding
+  limit match_count;
+end;
+$$;
@@ -0,0 +1,58 @@
+-- Keep scanning the HNSW index until enough rows pass the filter
+-- The project/user filter in search_segments is applied to what the HNSW
+-- scan returns, and a plain scan stops after ef_search (100) candidates from
+-- the table shared by every user. A project whose rows aren't among those
+-- got fewer than match_count rows, or none. With iterative scans the index
+-- keeps producing candidates until the filtered query is satisfied (up to
+-- hnsw.max_scan_tuples). relaxed_order may return candidates slightly out of
+-- order, which is fine here since they're re-ranked at full precision.
+-- Requires pgvector 0.8.0+, where hnsw.iterative_scan was added.
+create or replace function search_segments(
+  query_embedding vector(1536),
+  match_project_id text,
+  match_user_id uuid,
+  match_count int default 30
+)
+returns table (
+  id uuid,
+  form_name text,
+  segment_text text,
+  segment_type text,
+  page_number int,
+  is_pii boolean,
+  similarity float
+)
+language plpgsql
+set hnsw.ef_search = 100
+set hnsw.iterative_scan = relaxed_order
+as $$
+begin
+  return query
+  with candidates as materialized (
+    select
+      se.id,
+      se.form_name,
+      se.segment_text,
+      se.segment_type,
+      se.page_number,
+      se.is_pii,
+      se.embedding
+    from segment_embeddings se
+    where se.project_id = match_project_id
+      and se.user_id = match_user_id
+    order by se.embedding::halfvec(1536) <#> query_embedding::halfvec(1536)
+    limit match_count * 2
+  )
+  select
+    c.id,
+    c.form_name,
+    c.segment_text,
+    c.segment_type,
+    c.page_number,
+    c.is_pii,
+    -(c.embedding <#> query_embedding) as similarity
+  from candidates c
+  order by c.embedding <#> query_embedding
+  limit match_count;
+end;
+$$;